@@ -1,27 +1,206 @@
-from flask import Flask, request, jsonify
-from tensorflow.keras.models import load_model
+import hashlib
+import os
+import queue
+import threading
+import time
+from collections import OrderedDict
+from flask import Flask, Response, request
+import onnxruntime as ort
 import numpy as np
+import cv2 as cv
+import orjson
+from labels import label_name
+from preprocess import decode_image
 
-leaf_deases_model = load_model('/home/shukur/Documents/Python Code/Tree Deases/Leaf_Deases(95,88).h5')
+# gunicorn runs several workers, so keep each one to a couple of cpu threads
+# instead of every worker starting one thread per core. INTRA_OP_THREADS=1
+# suits 1-2 vcpu serverless machines
+sess_options = ort.SessionOptions()
+sess_options.intra_op_num_threads = int(os.environ.get('INTRA_OP_THREADS', min(2, os.cpu_count() or 1)))
+sess_options.inter_op_num_threads = 1
+# idle pool threads sleep instead of spinning, spinning threads in one worker
+# take cpu away from the others
+sess_options.add_session_config_entry('session.intra_op.allow_spinning', '0')
 
-label_name = ['Apple scab','Apple Black rot', 'Apple Cedar apple rust', 'Apple healthy', 'Cherry Powdery mildew',
-'Cherry healthy','Corn Cercospora leaf spot Gray leaf spot', 'Corn Common rust', 'Corn Northern Leaf Blight','Corn healthy', 
-'Grape Black rot', 'Grape Esca', 'Grape Leaf blight', 'Grape healthy','Peach Bacterial spot','Peach healthy', 'Pepper bell Bacterial spot', 
-'Pepper bell healthy', 'Potato Early blight', 'Potato Late blight', 'Potato healthy', 'Strawberry Leaf scorch', 'Strawberry healthy',
-'Tomato Bacterial spot', 'Tomato Early blight', 'Tomato Late blight', 'Tomato Leaf Mold', 'Tomato Septoria leaf spot',
-'Tomato Spider mites', 'Tomato Target Spot', 'Tomato Yellow Leaf Curl Virus', 'Tomato mosaic virus', 'Tomato healthy']
+# TensorRT/CUDA on nvidia gpus and OpenVINO on intel cpus when the installed
+# onnxruntime build has them, the default cpu kernels otherwise
+providers = [provider for provider in ['TensorrtExecutionProvider', 'CUDAExecutionProvider',
+                                       'OpenVINOExecutionProvider', 'CPUExecutionProvider']
+             if provider in ort.get_available_providers()]
+
+# onnx model made by convert_model.py
+leaf_deases_model = ort.InferenceSession('/home/shukur/Documents/Python Code/Tree Deases/Leaf_Deases(95,88).onnx',
+                                         sess_options, providers=providers)
+input_name = leaf_deases_model.get_inputs()[0].name
+
+# requests are grouped into one run call, up to max_batch_size images
+# or max_latency seconds after the first one arrived. When nothing is queued and
+# no other request is still decoding, the batch goes right away
+max_batch_size, max_latency = 16, 0.02
+request_queue = queue.Queue()
+# requests that are decoding their images and will be queued soon. A request
+# queues its images and leaves preparing in one step under preparing_changed, so
+# the worker can't miss it
+preparing = 0
+preparing_changed = threading.Condition()
+batch_buffer = np.empty((max_batch_size,150,150,3), np.float32)
+thread_local = threading.local()
+
+# the first runs set up kernels and memory arenas, do them at startup instead of in
+# the first requests. TensorRT rebuilds its engine for batch sizes outside the range
+# it has seen, so run both the smallest and the largest batch
+for n in (1, max_batch_size):
+    batch_buffer[:n] = 0
+    leaf_deases_model.run(None, {input_name: batch_buffer[:n]})
+
+def batch_worker():
+    while True:
+        batch = [request_queue.get()]
+        deadline = time.monotonic() + max_latency
+        while len(batch) < max_batch_size:
+            with preparing_changed:
+                # wait for requests still decoding to queue their images (or give
+                # up), but not past the deadline
+                while request_queue.empty() and preparing:
+                    timeout = deadline - time.monotonic()
+                    if timeout <= 0:
+                        break
+                    preparing_changed.wait(timeout)
+                if request_queue.empty():
+                    break
+                batch.append(request_queue.get_nowait())
+
+        try:
+            # uint8 to float32 straight into the batch, the onnx model takes BGR
+            for i, item in enumerate(batch):
+                np.multiply(item['img'], np.float32(1.0/255.0), out=batch_buffer[i])
+            pridict_images = leaf_deases_model.run(None, {input_name: batch_buffer[:len(batch)]})[0]
+        except Exception as e:
+            pridict_images = [e] * len(batch)
+
+        for item, pridict_image in zip(batch, pridict_images):
+            item['result'] = pridict_image
+            item['done'].set()
+
+threading.Thread(target=batch_worker, daemon=True).start()
+
+# results of recently seen uploads, keyed by the blake2b hash of the file bytes
+max_cached_results = 1024
+result_cache = OrderedDict()
+result_cache_lock = threading.Lock()
+
+def predict(datas):
+    global preparing
+    with preparing_changed:
+        preparing += 1
+    ready = None
+    try:
+        # every server thread resizes into its own uint8 buffers (at most
+        # max_batch_size of them), they are free again once the batch worker has
+        # scaled them into batch_buffer
+        if not hasattr(thread_local, 'imgs'):
+            thread_local.imgs = np.empty((max_batch_size,150,150,3), np.uint8)
+
+        # each image is resized right after decoding, so only one full size
+        # decode is held at a time
+        items = []
+        for i, data in enumerate(datas):
+            img = decode_image(data)
+            if img is None:
+                return None
+            items.append({'img': cv.resize(img, (150,150), dst=thread_local.imgs[i], interpolation=cv.INTER_AREA),
+                          'done': threading.Event()})
+        ready = items
+    finally:
+        # nothing is queued when decoding failed, the worker is woken either way
+        with preparing_changed:
+            for item in ready or ():
+                request_queue.put(item)
+            preparing -= 1
+            preparing_changed.notify()
+
+    for item in ready:
+        item['done'].wait()
+        if isinstance(item['result'], Exception):
+            raise item['result']
+    return [item['result'] for item in ready]
+
+# jpeg, png, bmp and tiff signatures plus webp, anything else is rejected
+# before it is hashed or decoded
+image_magic = (b'\xff\xd8\xff', b'\x89PNG\r\n\x1a\n', b'BM', b'II*\x00', b'MM\x00*')
+
+def is_image(data):
+    # webp is a RIFF container with WEBP at byte 8, other RIFF files (wav, avi) are not images
+    return data.startswith(image_magic) or (data[:4] == b'RIFF' and data[8:12] == b'WEBP')
+
+# error bodies never change, so they are serialized once
+no_img_error = orjson.dumps({"Error": "no img file in the request"})
+bad_img_error = orjson.dumps({"Error": "img is not a supported image"})
+too_many_imgs_error = orjson.dumps({"Error": f"at most {max_batch_size} img files per request"})
+
+def classify(files):
+    # check every file's signature before reading any of them whole, werkzeug
+    # keeps uploads in seekable BytesIO or temp files
+    for file in files:
+        if not is_image(file.stream.read(12)):
+            return None
+        file.stream.seek(0)
+    datas = [file.read() for file in files]
+    keys = [hashlib.blake2b(data, digest_size=16).digest() for data in datas]
+
+    with result_cache_lock:
+        pridict_images = [result_cache.get(key) for key in keys]
+        for key, pridict_image in zip(keys, pridict_images):
+            if pridict_image is not None:
+                result_cache.move_to_end(key)
+
+    missing = [i for i, pridict_image in enumerate(pridict_images) if pridict_image is None]
+    results = predict([datas[i] for i in missing])
+    if results is None:
+        return None
+
+    for i, pridict_image in zip(missing, results):
+        pridict_images[i] = pridict_image
+        with result_cache_lock:
+            result_cache[keys[i]] = pridict_image
+            if len(result_cache) > max_cached_results:
+                result_cache.popitem(last=False)
+    return pridict_images
+
+def result_json(pridict_image):
+    idx = int(pridict_image.argmax())
+    return {"Label Name":label_name[idx], "Accuracy": float(pridict_image[idx])*100}
 
 app = Flask(__name__)
+# bigger requests get a 413 before anything is read, room for a full /batch of phone photos
+app.config['MAX_CONTENT_LENGTH'] = 64 * 1024 * 1024
 
 @app.route("/",methods=['POST'])
 def just():
-    data = request.json
-    img = np.array(data['img'])
+    if 'img' not in request.files:
+        return Response(no_img_error, status=400, mimetype='application/json')
+    pridict_images = classify([request.files['img']])
+    if pridict_images is None:
+        return Response(bad_img_error, status=400, mimetype='application/json')
+
+    return Response(orjson.dumps(result_json(pridict_images[0])), mimetype='application/json')
 
-    pridict_image = leaf_deases_model.predict(img.reshape((1,) + img.shape ))
+# up to max_batch_size img files in one request, all of them go through the
+# batch worker together
+@app.route("/batch",methods=['POST'])
+def just_batch():
+    if 'img' not in request.files:
+        return Response(no_img_error, status=400, mimetype='application/json')
+    files = request.files.getlist('img')
+    if len(files) > max_batch_size:
+        return Response(too_many_imgs_error, status=400, mimetype='application/json')
+    pridict_images = classify(files)
+    if pridict_images is None:
+        return Response(bad_img_error, status=400, mimetype='application/json')
 
-    return jsonify({"Label Name":label_name[np.argmax(pridict_image)],
-                  "Accuracy": pridict_image[0][np.argmax(pridict_image)]*100})
+    return Response(orjson.dumps([result_json(pridict_image) for pridict_image in pridict_images]),
+                    mimetype='application/json')
 
+# only for local testing, serve it with gunicorn_conf.py
 if __name__ == "__main__":
-    app.run(debug=True)
\ No newline at end of file
+    app.run()
\ No newline at end of file
@@ -1,11 +1,20 @@
 import requests
 import numpy as np
-from keras.preprocessing.image import load_img,img_to_array
+import cv2 as cv
 
 url = 'http://127.0.0.1:5000/'
+max_size = 1024
 
-img = img_to_array(load_img('DanLeaf2.jpg',target_size=(150,150,3)))
+with open('DanLeaf2.jpg','rb') as f:
+    data = f.read()
 
-r = requests.post(url, json={'img':img.tolist()})
+# the model only sees 150x150, so big phone photos are shrunk before uploading
+img = cv.imdecode(np.frombuffer(data, np.uint8), cv.IMREAD_COLOR)
+if max(img.shape[:2]) > max_size:
+    scale = max_size / max(img.shape[:2])
+    img = cv.resize(img, None, fx=scale, fy=scale, interpolation=cv.INTER_AREA)
+    data = cv.imencode('.jpg', img, [cv.IMWRITE_JPEG_QUALITY, 85])[1].tobytes()
+
+r = requests.post(url, files={'img':('DanLeaf2.jpg', data)})
 
 print(f"\n\n{r.json()}\n\n")
\ No newline at end of file
@@ -0,0 +1,57 @@
+import os
+import sys
+import numpy as np
+import tensorflow as tf
+from tensorflow.keras.preprocessing.image import load_img,img_to_array
+
+usage = '''usage: python convert_model.py int8 <train image dir>
+       python convert_model.py fp16
+       python convert_model.py onnx
+the train dir is the PlantVillage train folder with one sub folder per class'''
+
+model_path = '/home/shukur/Documents/Python Code/Tree Deases/Leaf_Deases(95,88).h5'
+n_of_image = 100
+
+
+def representative_dataset():
+    train_dir = sys.argv[2]
+    img_path_list = [os.path.join(root,name) for root,_,names in os.walk(train_dir) for name in names]
+    np.random.shuffle(img_path_list)
+
+    for img_path in img_path_list[:n_of_image]:
+        img = img_to_array(load_img(img_path,target_size=(150,150,3)))/255
+        yield [img.reshape((1,) + img.shape)]
+
+
+# check the arguments before spending time on loading the model
+mode = sys.argv[1] if len(sys.argv) > 1 else None
+if mode not in ('int8', 'fp16', 'onnx'):
+    sys.exit(usage)
+if mode == 'int8' and (len(sys.argv) < 3 or not os.path.isdir(sys.argv[2])):
+    sys.exit(f'int8 needs the train image dir for calibration\n{usage}')
+
+leaf_deases_model = tf.keras.models.load_model(model_path)
+
+if mode == 'onnx':
+    import tf2onnx
+    # the model was trained on RGB, the API feeds it OpenCV's BGR images so the
+    # onnx model takes BGR and flips the channels itself
+    bgr_model = tf.keras.Sequential([tf.keras.layers.Lambda(lambda x: tf.reverse(x, axis=[-1]), input_shape=(150,150,3)),
+                                     leaf_deases_model])
+    tf2onnx.convert.from_keras(bgr_model, opset=13, output_path=model_path.replace('.h5','.onnx'),
+                               input_signature=(tf.TensorSpec((None,150,150,3), tf.float32, name='input'),))
+    sys.exit()
+
+converter = tf.lite.TFLiteConverter.from_keras_model(leaf_deases_model)
+converter.optimizations = [tf.lite.Optimize.DEFAULT]
+
+if mode == 'int8':
+    converter.representative_dataset = representative_dataset
+    converter.target_spec.supported_ops = [tf.lite.OpsSet.TFLITE_BUILTINS_INT8]
+    converter.inference_input_type = tf.int8
+    converter.inference_output_type = tf.int8
+else:
+    converter.target_spec.supported_types = [tf.float16]
+
+with open(model_path.replace('.h5',f'_{mode}.tflite'),'wb') as f:
+    f.write(converter.convert())
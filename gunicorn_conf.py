@@ -0,0 +1,13 @@
+import os
+
+# gunicorn -c gunicorn_conf.py "Make API:app"
+bind = '0.0.0.0:5000'
+worker_class = 'gthread'
+workers = max(1, (os.cpu_count() or 1)//2)
+# one thread per request in flight, so a worker can fill a whole batch
+# (max_batch_size in Make API.py). Inference runs outside the GIL, threads are cheap
+threads = 16
+
+# every worker loads its own model and starts its own batch thread, the onnx
+# runtime threads and the batch thread do not survive a fork from a preloaded master
+preload_app = False
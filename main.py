@@ -1,21 +1,54 @@
-from tensorflow.keras.models import load_model
-from tensorflow.keras.preprocessing.image import load_img,img_to_array
+import os
+import sys
+import tensorflow as tf
 import numpy as np
+import cv2 as cv
+from labels import label_name
+from preprocess import decode_image
 
 
-leaf_deases_model = load_model('/home/shukur/Documents/Python Code/Tree Deases/Leaf_Deases(95,88).h5')
+# int8 or fp16 model made by convert_model.py, the int8 one when both exist.
+# LEAF_MODEL=<path to .tflite> picks a model explicitly
+model_path = '/home/shukur/Documents/Python Code/Tree Deases/Leaf_Deases(95,88)_int8.tflite'
+if not os.path.exists(model_path):
+    model_path = model_path.replace('_int8','_fp16')
+model_path = os.environ.get('LEAF_MODEL', model_path)
 
-label_name = ['Apple scab','Apple Black rot', 'Apple Cedar apple rust', 'Apple healthy', 'Cherry Powdery mildew',
-'Cherry healthy','Corn Cercospora leaf spot Gray leaf spot', 'Corn Common rust', 'Corn Northern Leaf Blight','Corn healthy', 
-'Grape Black rot', 'Grape Esca', 'Grape Leaf blight', 'Grape healthy','Peach Bacterial spot','Peach healthy', 'Pepper bell Bacterial spot', 
-'Pepper bell healthy', 'Potato Early blight', 'Potato Late blight', 'Potato healthy', 'Strawberry Leaf scorch', 'Strawberry healthy',
-'Tomato Bacterial spot', 'Tomato Early blight', 'Tomato Late blight', 'Tomato Leaf Mold', 'Tomato Septoria leaf spot',
-'Tomato Spider mites', 'Tomato Target Spot', 'Tomato Yellow Leaf Curl Virus', 'Tomato mosaic virus', 'Tomato healthy']
-                   
+leaf_deases_model = tf.lite.Interpreter(model_path=model_path, num_threads=os.cpu_count())
+input_detail = leaf_deases_model.get_input_details()[0]
+output_detail = leaf_deases_model.get_output_details()[0]
 
-path = input('Imag Path')
-img = img_to_array(load_img(path,target_size=(150,150,3)))
 
-pridict_image = leaf_deases_model.predict( img.reshape((1,) + img.shape ))
+# python main.py img1.jpg img2.jpg ... runs all of them in one batch
+paths = sys.argv[1:] or [input('Imag Path')]
+img = np.empty((len(paths),150,150,3), np.float32)
+for i, path in enumerate(paths):
+    try:
+        with open(path,'rb') as f:
+            decoded = decode_image(f.read())
+    except OSError:
+        decoded = None
+    if decoded is None:
+        sys.exit(f"can't read image {path}")
+    # the BGR to RGB flip is a view of the resized image, the multiply writes it
+    # straight into the batch buffer
+    small = cv.resize(decoded, (150,150), interpolation=cv.INTER_AREA)
+    np.multiply(small[:, :, ::-1], np.float32(1.0/255.0), out=img[i])
 
-print(f"{label_name[np.argmax(pridict_image)]} {pridict_image[0][np.argmax(pridict_image)]*100}%")
\ No newline at end of file
+# the fp16 model takes and returns float32, only the int8 one is quantized
+scale, zero_point = input_detail['quantization']
+if scale:
+    img = np.clip(np.round(img/scale + zero_point), -128, 127)
+leaf_deases_model.resize_tensor_input(input_detail['index'], img.shape)
+leaf_deases_model.allocate_tensors()
+leaf_deases_model.set_tensor(input_detail['index'], img.astype(input_detail['dtype']))
+leaf_deases_model.invoke()
+
+pridict_image = leaf_deases_model.get_tensor(output_detail['index']).astype(np.float32)
+scale, zero_point = output_detail['quantization']
+if scale:
+    pridict_image = (pridict_image - zero_point) * scale
+
+for path, probs in zip(paths, pridict_image):
+    idx = int(probs.argmax())
+    print(f"{path}: {label_name[idx]} {float(probs[idx])*100}%")
\ No newline at end of file
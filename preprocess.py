@@ -0,0 +1,37 @@
+import io
+import numpy as np
+import cv2 as cv
+from PIL import Image
+
+# (factor, flag) from the cheapest decode down
+reduced_flags = ((8, cv.IMREAD_REDUCED_COLOR_8), (4, cv.IMREAD_REDUCED_COLOR_4), (2, cv.IMREAD_REDUCED_COLOR_2))
+
+
+def decode_image(data, size=150):
+    # libjpeg can decode a JPEG at 1/2, 1/4 or 1/8 scale and skip most of the
+    # DCT work, use the smallest one that still leaves size px on both sides.
+    # Pillow only reads the header here to get the dimensions
+    # like cv.imdecode on bad data, empty or undecodable input gives None
+    if not data:
+        return None
+    flag = cv.IMREAD_COLOR
+    if data.startswith(b'\xff\xd8\xff'):
+        try:
+            width, height = Image.open(io.BytesIO(data)).size
+        except Image.DecompressionBombError:
+            # too many pixels for Pillow, the image is known to be huge so it is
+            # never decoded at full size
+            flag = cv.IMREAD_REDUCED_COLOR_8
+        except OSError:
+            # unreadable header, left to OpenCV at full size
+            pass
+        else:
+            for factor, reduced_flag in reduced_flags:
+                if min(width, height) // factor >= size:
+                    flag = reduced_flag
+                    break
+
+    try:
+        return cv.imdecode(np.frombuffer(data, np.uint8), flag)
+    except cv.error:
+        return None